@@ -4,37 +4,184 @@
 import os
 import sys
 import subprocess
+import shlex
 import argparse
 import time
+import threading
 import json
 import math
+import re
 from os.path import getsize
-from datetime import datetime as dt
-from tempfile import mkstemp
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+
+try:
+	# faster JSON parsing for ffprobe's output if it's installed
+	from orjson import loads as json_loads
+except ImportError:
+	json_loads = json.loads
+
+try:
+	import fcntl
+except ImportError:
+	# not available on Windows
+	fcntl = None
+
+# (maxrate, bufsize) pairs, bufsize is 1.5x the maxrate
+YT_BITRATES = {
+	30: {
+		2880: ("64M", "96M"),
+		2160: ("45M", "68M"),
+		1440: ("16M", "24M"),
+		1080: ("8M", "12M"),
+		720: ("5M", "8M"),
+		480: ("3M", "4M"),
+		360: ("1M", "2M")
+	},
+	60: {
+		2880: ("80M", "120M"),
+		2160: ("64M", "96M"),
+		1440: ("24M", "36M"),
+		1080: ("12M", "18M"),
+		720: ("8M", "12M"),
+		480: ("4M", "6M"),
+		360: ("2M", "3M")
+	}
+}
+
+CRF_X264 = 17
+CRF_X265 = 22
+CQ_NVENC = 0
+QP_NVENC = 21
+PRESET = "slow"
+
+# seconds to wait for ffprobe before giving up
+FFPROBE_TIMEOUT = 60
+
+# requested size of the pipe ffmpeg writes its output to
+PIPE_SIZE = 1 << 20
+
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "ffauto")
+
+# frame number and timestamp in ffmpeg's progress lines
+PROGRESS_RE = re.compile(rb"frame=\s*(\d+)(?:.*?\btime=\s*(\S+))?")
+
+OPT_GLOBAL = ("-loglevel", "warning", "-hide_banner")
+
+# decode on the GPU and keep the decoded frames there for the CUDA filters
+NV_HWACCEL = ("-hwaccel", "cuda", "-hwaccel_output_format", "cuda")
+
+# what ffprobe is asked for, also part of the probe cache key
+PROBE_ENTRIES = "stream=codec_type,codec_name,width,height,duration,r_frame_rate,avg_frame_rate:format=duration"
+
+# only read the container headers, finish_video_info() retries without these if that isn't enough
+QUICK_PROBE_ARGS = ["-probesize", "32k", "-analyzeduration", "0", "-loglevel", "quiet"]
+
+# output modes and the encoder each of them uses
+MODE_CODECS = {
+	"youtube": "libx264",
+	"nvidia": "h264_nvenc",
+	"x264": "libx264",
+	"x265": "libx265",
+	"gif": "gif",
+	"apng": "apng",
+	"webp": "libwebp",
+}
+
+# static encoder options, CRF values and mode-specific options are added in main()
+CODEC_OPTIONS = {
+	"libx264": ("-preset", PRESET, "-pix_fmt", "yuv420p", "-tune", "film", "-profile:v", "high", "-level", "5.2", "-x264-params", "threads=0:lookahead-threads=2:sliced-threads=0"),
+	"libx265": ("-preset", PRESET, "-x265-params", "pools=+:frame-threads=4"),
+	"h264_nvenc": ("-preset", "p6", "-tune", "hq", "-profile:v", "high", "-level", "5.2", "-rc", "constqp", "-qp", str(QP_NVENC), "-rc-lookahead", "48", "-spatial-aq", "1", "-temporal-aq", "1", "-aq-strength", "8"),
+	"gif": ("-f", "gif", "-loop", "0"),
+	"apng": ("-f", "apng", "-plays", "0"),
+	"libwebp": ("-f", "webp", "-loop", "0"),
+}
+
+# NVDEC decoders for ffprobe's codec names, used to crop in the decoder in Nvidia mode
+CUVID_DECODERS = {
+	"h264": "h264_cuvid",
+	"hevc": "hevc_cuvid",
+	"av1": "av1_cuvid",
+	"vp8": "vp8_cuvid",
+	"vp9": "vp9_cuvid",
+	"mpeg1video": "mpeg1_cuvid",
+	"mpeg2video": "mpeg2_cuvid",
+	"mpeg4": "mpeg4_cuvid",
+	"vc1": "vc1_cuvid",
+	"mjpeg": "mjpeg_cuvid",
+}
+
+# swscale scaling modes that have a zscale equivalent
+ZSCALE_FILTERS = {
+	"bilinear": "bilinear",
+	"bicubic": "bicubic",
+	"neighbor": "point",
+	"lanczos": "lanczos",
+	"spline": "spline36",
+}
+
+# video filters in the order they're applied, and whether they can run on the GPU in Nvidia mode
+VIDEO_FILTERS = (
+	("fps", True),
+	("fixrgb", False),
+	("crop", False),
+	("scale", True),
+	("eq", False),
+	("sharpen", False),
+	("loop", False),
+	("vfade", False),
+)
+
+_YT_FPS_KEYS = tuple(sorted(YT_BITRATES))
+_YT_HEIGHT_KEYS = tuple(sorted(YT_BITRATES[30]))
 
 def closest(num, arr):
-	filtered = filter(lambda x: x >= num, arr)
-	return min(filtered)
+	# smallest key >= num, or the largest key if num exceeds all of them
+	i = bisect_left(arr, num)
+	return arr[i] if i < len(arr) else arr[-1]
+
+def _join(sep, *parts):
+	return sep.join(p for p in parts if p)
+
+def _hw_chain(filters):
+	# filters is a list of (filter, runs_on_gpu) pairs, consecutive CPU-only
+	# filters share a single hwdownload/hwupload round trip
+	chain = []
+	cpu_filters = []
+	for f, on_gpu in filters:
+		if not f:
+			continue
+
+		if on_gpu:
+			if cpu_filters:
+				chain.append(f"hwdownload,format=nv12,{','.join(cpu_filters)},hwupload_cuda")
+				cpu_filters = []
+			chain.append(f)
+		else:
+			cpu_filters.append(f)
+
+	if cpu_filters:
+		chain.append(f"hwdownload,format=nv12,{','.join(cpu_filters)},hwupload_cuda")
+
+	return ",".join(chain)
 
 def ceil_even(num):
 	return math.ceil(num / 2.0) * 2
 
-# from humanize package
-def readable_size(value, binary=False, gnu=False, format="%.1f"):
-	suffixes = {
-		"decimal": ("kB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB"),
-		"binary": ("KiB", "MiB", "GiB", "TiB", "PiB", "EiB", "ZiB", "YiB"),
-		"gnu": "KMGTPEZY",
-	}
+def _size_units(base, suffix):
+	# suffix i is used for values below base ** (i + 2)
+	return base, tuple(base ** (i + 2) for i in range(len(suffix))), suffix
 
-	if gnu:
-		suffix = suffixes["gnu"]
-	elif binary:
-		suffix = suffixes["binary"]
-	else:
-		suffix = suffixes["decimal"]
+_SIZE_UNITS = {
+	"decimal": _size_units(1000, ("kB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB")),
+	"binary": _size_units(1024, ("KiB", "MiB", "GiB", "TiB", "PiB", "EiB", "ZiB", "YiB")),
+	"gnu": _size_units(1024, "KMGTPEZY"),
+}
 
-	base = 1024 if (gnu or binary) else 1000
+# from humanize package
+def readable_size(value, binary=False, gnu=False, format="%.1f"):
+	base, thresholds, suffix = _SIZE_UNITS["gnu" if gnu else "binary" if binary else "decimal"]
 	bytes = float(value)
 	abs_bytes = abs(bytes)
 
@@ -45,37 +192,44 @@ def readable_size(value, binary=False, gnu=False, format="%.1f"):
 	elif abs_bytes < base and gnu:
 		return "%dB" % bytes
 
-	for i, s in enumerate(suffix):
-		unit = base ** (i + 2)
-		if abs_bytes < unit and not gnu:
-			return (format + " %s") % ((base * bytes / unit), s)
-		elif abs_bytes < unit and gnu:
-			return (format + "%s") % ((base * bytes / unit), s)
+	i = min(bisect_right(thresholds, abs_bytes), len(thresholds) - 1)
 	if gnu:
-		return (format + "%s") % ((base * bytes / unit), s)
-	return (format + " %s") % ((base * bytes / unit), s)
+		return (format + "%s") % ((base * bytes / thresholds[i]), suffix[i])
+	return (format + " %s") % ((base * bytes / thresholds[i]), suffix[i])
 
+@lru_cache(maxsize=256)
 def parse_ffmpeg_timestamp(timestamp, debug):
-	timestamp_formats = ["%H:%M:%S.%f", "%H:%M:%S", "%M:%S.%f", "%M:%S"]
+	parts = timestamp.split(":")
+	seconds, _, frac = parts[-1].partition(".")
+
+	# int() and float() would also accept signs, whitespace, underscores, exponents, and so on
+	if not all(p.isdigit() for p in parts[:-1]) or not (seconds + frac).isdigit():
+		raise ValueError(f"Couldn't parse timestamp {timestamp}")
+
+	if len(parts) == 1:
+		return float(timestamp)
 
 	try:
-		parsed = float(timestamp)
-		return parsed
+		if len(parts) == 3:
+			fmt = "%H:%M:%S"
+			total = int(parts[0]) * 3600 + int(parts[1]) * 60 + int(seconds)
+		elif len(parts) == 2:
+			fmt = "%M:%S"
+			total = int(parts[0]) * 60 + int(seconds)
+		else:
+			raise ValueError
+
+		if frac:
+			fmt += ".%f"
+			total += int(frac.ljust(6, "0")[:6]) / 1e6
 	except ValueError:
-		zero = dt(1900,1,1)
-		ret_val = -1
-		for fmt in timestamp_formats:
-			try:
-				parsed = dt.strptime(timestamp, fmt)
-				ret_val = round((parsed - zero).total_seconds(), 4)
-				if debug:
-					print(f"Parsed timestamp {timestamp} with {fmt} and got {ret_val}")
-			except ValueError:
-				continue
+		raise ValueError(f"Couldn't parse timestamp {timestamp}") from None
 
-		return ret_val
-	else:
-		return 0
+	parsed = round(float(total), 4)
+	if debug:
+		print(f"Parsed timestamp {timestamp} with {fmt} and got {parsed}")
+
+	return parsed
 
 def format_seconds_as_timestamp(seconds):
 	minutes, seconds = divmod(seconds, 60)
@@ -92,42 +246,66 @@ def format_seconds_as_timestamp(seconds):
 	else:
 		return f"{minutes:02g}:{fmt_seconds(seconds)}"
 
-def get_video_info(video, debug):
+def start_video_info(video, quick=True):
 	ffprobe_args = ["ffprobe", "-i", video,
 							# "-select_streams", "v:0",
 							"-hide_banner",
 							"-print_format", "json",
-							# "-loglevel", "quiet",
-							"-show_entries", "stream=width,height,duration,r_frame_rate"]
+							"-show_entries", PROBE_ENTRIES]
 
-	p = subprocess.Popen(ffprobe_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+	if quick:
+		ffprobe_args += QUICK_PROBE_ARGS
 
-	ffprobe_output = p.stdout.read()
-	ffprobe_json = json.loads(ffprobe_output)
+	return subprocess.Popen(ffprobe_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-	if "streams" not in ffprobe_json:
-		if debug:
-			print(f"ffprobe args: {ffprobe_args}")
-			print(f"ffprobe output: {ffprobe_output}")
-		raise RuntimeError("ffprobe failed.")
+def _video_stream(ffprobe_json):
+	return next((s for s in ffprobe_json.get("streams", []) if s.get("codec_type") == "video"), None)
+
+def _probe_complete(ffprobe_json):
+	# with only the headers, some containers (e.g. MPEG-TS) don't report the size or frame rate yet
+	stream = _video_stream(ffprobe_json)
+	if stream is None or not stream.get("width") or not stream.get("height") or stream.get("r_frame_rate", "0/0").startswith("0/"):
+		return False
 
-	stream = ffprobe_json["streams"][0]
+	return "duration" in ffprobe_json.get("format", {}) or any("duration" in s for s in ffprobe_json["streams"])
+
+def finish_video_info(p, debug):
 	try:
-		if "/" in stream["r_frame_rate"]:
-			dividend, divisor = stream["r_frame_rate"].split("/")
-			stream["r_frame_rate"] = int(dividend)/int(divisor)
-	except Exception as e:
-		if len(ffprobe_json["streams"]) < 2:
-			raise e
+		ffprobe_output, ffprobe_errors = p.communicate(timeout=FFPROBE_TIMEOUT)
+	except subprocess.TimeoutExpired:
+		p.kill()
+		p.communicate()
+		raise RuntimeError("ffprobe timed out.")
 
-		stream = ffprobe_json["streams"][1]
-		if "/" in stream["r_frame_rate"]:
-			dividend, divisor = stream["r_frame_rate"].split("/")
-			stream["r_frame_rate"] = int(dividend)/int(divisor)
+	ffprobe_json = json_loads(ffprobe_output) if p.returncode == 0 else {}
 
+	if QUICK_PROBE_ARGS[0] in p.args and not _probe_complete(ffprobe_json):
+		# the quick probe didn't get far enough into the file, try again with ffprobe's default analysis
+		video = p.args[p.args.index("-i") + 1]
+		return finish_video_info(start_video_info(video, quick=False), debug)
+
+	stream = _video_stream(ffprobe_json)
+	if stream is None:
+		if debug:
+			print(f"ffprobe args: {p.args}")
+			print(f"ffprobe output: {ffprobe_output.decode(errors='replace')}")
+			print(f"ffprobe errors: {ffprobe_errors.decode(errors='replace')}")
+		raise RuntimeError("ffprobe failed.")
+
+	# some streams report 0/0 even after a full analysis, leave the frame rate unset then
+	for key in ("r_frame_rate", "avg_frame_rate"):
+		dividend, sep, divisor = stream.get(key, "0/0").partition("/")
+		if sep and int(dividend) and int(divisor):
+			stream["r_frame_rate"] = int(dividend)/int(divisor)
+			break
+	else:
+		stream.pop("r_frame_rate", None)
 
 	if "duration" in stream:
 		stream["duration"] = float(stream["duration"])
+	elif "duration" in ffprobe_json.get("format", {}):
+		# Matroska/WebM streams don't have a duration of their own
+		stream["duration"] = float(ffprobe_json["format"]["duration"])
 	else:
 		print("Falling back to duration heuristics")
 		for s in ffprobe_json["streams"]:
@@ -142,76 +320,250 @@ def get_video_info(video, debug):
 
 	return stream
 
+def filters_cache_path():
+	# the filter list only changes when the ffmpeg binary does
+	import shutil
+	ffmpeg = shutil.which("ffmpeg")
+	if ffmpeg is None:
+		return None
+
+	ffmpeg = os.path.realpath(ffmpeg)
+	st = os.stat(ffmpeg)
+	import hashlib
+	key = f"{ffmpeg}|{st.st_size}|{st.st_mtime_ns}"
+	return os.path.join(CACHE_DIR, f"filters_{hashlib.blake2b(key.encode(), digest_size=16).hexdigest()}.txt")
+
+@lru_cache(maxsize=None)
+def available_filters():
+	cache_file = filters_cache_path()
+	if cache_file is not None:
+		try:
+			with open(cache_file) as f:
+				return frozenset(f.read().split())
+		except OSError:
+			pass
+
+	# filter lines look like " TSC scale_cuda        V->V       GPU accelerated video resizer"
+	p = subprocess.run(["ffmpeg", "-hide_banner", "-filters"], capture_output=True, text=True, check=False)
+	filters = frozenset(parts[1] for parts in map(str.split, p.stdout.splitlines()) if len(parts) >= 3 and "->" in parts[2])
+
+	if cache_file is not None and p.returncode == 0 and filters:
+		try:
+			os.makedirs(CACHE_DIR, exist_ok=True)
+			with open(cache_file, "w") as f:
+				f.write("\n".join(sorted(filters)))
+		except OSError:
+			pass
+
+	return filters
+
+def palette_cache_path(video, *params):
+	# palettes depend on the exact input file and everything that affects the frames fed into palettegen
+	try:
+		st = os.stat(video)
+	except OSError:
+		# not a local file (e.g. a URL), don't cache
+		return None
+
+	import hashlib
+	key = json.dumps([os.path.realpath(video), st.st_size, st.st_mtime_ns, *params])
+	return os.path.join(CACHE_DIR, f"palette_{hashlib.sha1(key.encode()).hexdigest()}.png")
+
+def finish_palette(tmp_file, palette_file, success):
+	# only a run that got through the whole clip leaves a palette worth keeping
+	try:
+		if success:
+			os.replace(tmp_file, palette_file)
+		else:
+			os.remove(tmp_file)
+	except OSError:
+		pass
+
+def probe_cache_path(video):
+	# ffprobe results only change when the file does
+	try:
+		st = os.stat(video)
+	except OSError:
+		# not a local file (e.g. a URL), don't cache
+		return None
+
+	import hashlib
+	key = f"{os.path.realpath(video)}|{st.st_size}|{st.st_mtime_ns}|{PROBE_ENTRIES}"
+	return os.path.join(CACHE_DIR, f"probe_{hashlib.blake2b(key.encode(), digest_size=16).hexdigest()}.json")
+
+def load_video_info(video):
+	cache_file = probe_cache_path(video)
+	if cache_file is None:
+		return None
+
+	try:
+		with open(cache_file, "rb") as f:
+			return json_loads(f.read())
+	except (OSError, ValueError):
+		return None
+
+def store_video_info(video, stream):
+	cache_file = probe_cache_path(video)
+	if cache_file is None:
+		return
+
+	try:
+		os.makedirs(CACHE_DIR, exist_ok=True)
+		with open(cache_file, "w") as f:
+			json.dump(stream, f)
+	except OSError:
+		pass
+
+def get_video_info(video, debug, p=None):
+	# p is an ffprobe process that was already started after a cache miss
+	stream = None if p else load_video_info(video)
+	if stream is None:
+		stream = finish_video_info(p or start_video_info(video), debug)
+		store_video_info(video, stream)
+
+	return stream
+
+def _drain(stream, output):
+	# the unbuffered pipe returns whatever ffmpeg has written so far, so
+	# \r-terminated progress updates show up as they arrive.
+	# every chunk is a new bytes object because the main thread may still be holding earlier ones,
+	# reusing one readinto() buffer would mean copying out of it for the queue anyway
+	while True:
+		data = stream.read(65536)
+		output.put(data)
+		if not data:
+			break
+
 def start_ffmpeg(args, debug):
+	# only needed when we wait for ffmpeg instead of exec'ing it
+	import queue
+
 	if debug:
 		print("#" * 40)
 		print("Script arguments:")
-		print(" ".join(args))
+		print(shlex.join(args))
 		print("#" * 40)
-		input("Press Enter to continue...")
+		if os.environ.get("FFAUTO_PAUSE"):
+			input("Press Enter to continue...")
+
+	start = time.monotonic_ns()
+
+	p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0)
+
+	# a larger pipe keeps ffmpeg from blocking on writes while we're busy printing (Linux only)
+	if hasattr(fcntl, "F_SETPIPE_SZ"):
+		try:
+			fcntl.fcntl(p.stdout.fileno(), fcntl.F_SETPIPE_SZ, PIPE_SIZE)
+		except OSError:
+			pass
+
+	# ffmpeg's output is read on a separate thread so the pipe keeps draining while we're printing
+	output = queue.Queue(maxsize=1024)
+	reader = threading.Thread(target=_drain, args=(p.stdout, output), daemon=True)
+	reader.start()
+
+	buf = bytearray()
+	oldline = b""
+	last_progress = None
+	skipped_progress = None
+	in_progress = False
+
+	def end_progress():
+		nonlocal skipped_progress, in_progress
+		# the last update of a run (e.g. ffmpeg's final summary) is always shown
+		if skipped_progress is not None:
+			print(skipped_progress.decode(errors="replace"), end="")
+			skipped_progress = None
+		print()
+		in_progress = False
 
-	start = time.time()
+	while True:
+		data = output.get()
+		if data:
+			buf += data
+			*lines, buf = buf.replace(b"\r", b"\n").split(b"\n")
+		else:
+			# EOF, flush whatever is left over
+			lines, buf = [buf], bytearray()
 
-	p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+		for line in lines:
+			line = line.strip()
+			if not line:
+				continue
 
-	oldline = ""
-	while True:
-		line = p.stdout.readline().strip()
-		if line == "" and p.poll() is not None:
-			returncode = p.returncode
-			if returncode == 0:
-				# ffmpeg has successfully exited
-				end = time.time()
-				print(f"ffmpeg completed in {time.strftime('%H:%M:%S', time.gmtime(end - start))}")
-			else:
-				return False, p.returncode
+			progress = PROGRESS_RE.match(line)
+			if progress:
+				# progress updates overwrite each other like they do in ffmpeg,
+				# and updates with the same frame and timestamp aren't printed at all
+				if progress.groups() != last_progress:
+					print(line.decode(errors="replace"), end="\r", flush=True)
+					last_progress = progress.groups()
+					skipped_progress = None
+				else:
+					skipped_progress = line
+				in_progress = True
+				continue
+
+			if in_progress:
+				end_progress()
+
+			if line != oldline:
+				print(line.decode(errors="replace"))
+
+			oldline = line
 
+		if not data:
 			break
 
-		if line != oldline:
-			print(line)
+	if in_progress:
+		end_progress()
 
-		oldline = line
+	reader.join()
+	p.stdout.close()
+
+	returncode = p.wait()
+	if returncode != 0:
+		return False, returncode
+
+	# ffmpeg has successfully exited
+	elapsed = (time.monotonic_ns() - start) // 1_000_000_000
+	print(f"ffmpeg completed in {elapsed // 3600:02d}:{elapsed // 60 % 60:02d}:{elapsed % 60:02d}")
 
 	return True, 0
 
-def main():
-	FAST_SEEK = False
+def timestamp_arg(value):
+	try:
+		parse_ffmpeg_timestamp(value, False)
+	except ValueError as e:
+		raise argparse.ArgumentTypeError(str(e)) from None
 
-	CRF_X264 = 17
-	CRF_X265 = 22
-	CQ_NVENC = 0
-	QP_NVENC = 21
-	PRESET = "slow"
-
-	YT_BITRATES = {
-		30: {
-			2880: "64M",
-			2160: "45M",
-			1440: "16M",
-			1080: "8M",
-			720: "5M",
-			480: "3M",
-			360: "1M"
-		},
-		60: {
-			2880: "80M",
-			2160: "64M",
-			1440: "24M",
-			1080: "12M",
-			720: "8M",
-			480: "4M",
-			360: "2M"
-		}
-	}
+	return value
 
+def size_arg(value):
+	# either an absolute size in pixels or a scaling factor like "0.5x"
+	value = value.lower()
+	try:
+		if value.endswith("x"):
+			size = float(value[:-1])
+		else:
+			size = int(value)
+	except ValueError:
+		size = None
+
+	# float() also accepts nan and inf
+	if size is None or not math.isfinite(size) or size <= 0:
+		raise argparse.ArgumentTypeError(f"invalid size value: '{value}'")
+
+	return value
+
+def _build_parser():
 	parser = argparse.ArgumentParser(description="Automate ffmpeg stuff")
 	parser.add_argument("-i", metavar="input", type=str, required=True, help="Input file")
-	parser.add_argument("-ss", metavar="start time", type=str, default="0", help="Start time")
+	parser.add_argument("-ss", metavar="start time", type=timestamp_arg, default="0", help="Start time")
 
 	duration_group = parser.add_mutually_exclusive_group()
-	duration_group.add_argument("-t", metavar="duration", type=str, default=None, help="Duration")
-	duration_group.add_argument("-to", metavar="position", type=str, default=None, help="Position")
+	duration_group.add_argument("-t", metavar="duration", type=timestamp_arg, default=None, help="Duration")
+	duration_group.add_argument("-to", metavar="position", type=timestamp_arg, default=None, help="Position")
 
 	audio_group = parser.add_mutually_exclusive_group()
 	audio_group.add_argument("-m", "--mute", action="store_true", help="Mute audio")
@@ -220,18 +572,19 @@ def main():
 	audio_group.add_argument("-n", "--normalize", action="store_true", help="Normalize volume")
 
 	size_group = parser.add_mutually_exclusive_group()
-	size_group.add_argument("-vw", "--width", metavar="width", type=str, default=None, help="New video width (keeps aspect ratio)")
-	size_group.add_argument("-vh", "--height", metavar="height", type=str, default=None, help="New video height (keeps aspect ratio)")
+	size_group.add_argument("-vw", "--width", metavar="width", type=size_arg, default=None, help="New video width (keeps aspect ratio)")
+	size_group.add_argument("-vh", "--height", metavar="height", type=size_arg, default=None, help="New video height (keeps aspect ratio)")
 
 	parser.add_argument("-vt", "--title", metavar="title", type=str, default=None, help="Video title")
-	parser.add_argument("-f", "--fade", metavar="duration", type=str, default=None, help="Fade in/out duration in seconds. Takes priority over -fi and -fo")
-	parser.add_argument("-fi", "--fadein", metavar="duration", type=str, default=None, help="Fade in duration in seconds")
-	parser.add_argument("-fo", "--fadeout", metavar="duration", type=str, default=None, help="Fade out duration in seconds")
+	parser.add_argument("-f", "--fade", metavar="duration", type=float, default=None, help="Fade in/out duration in seconds. Takes priority over -fi and -fo")
+	parser.add_argument("-fi", "--fadein", metavar="duration", type=float, default=None, help="Fade in duration in seconds")
+	parser.add_argument("-fo", "--fadeout", metavar="duration", type=float, default=None, help="Fade out duration in seconds")
 	parser.add_argument("-c", "--crop", metavar="w:h:x:y", type=str, default=None, help="New video region")
 	parser.add_argument("-r", "--framerate", metavar="framerate", type=str, default=None, help="New video frame rate")
 	parser.add_argument("-l", "--loop", metavar="loop", type=str, default=None, help="Video loop count")
 	parser.add_argument("-ff", "--ffmpeg", metavar="args", type=str, default=None, help="Passthrough arguments for ffmpeg")
 	parser.add_argument("-fs", "--fast-seek", action="store_true", help="Force-enables fast seek")
+	parser.add_argument("-fw", "--follow", action="store_true", help="Keep running while ffmpeg encodes to report encoding time and output file size")
 	parser.add_argument("-sm", "--scale-mode", type=str, default="spline", choices=["bilinear", "bicubic", "neighbor", "area", "bicublin", "gauss", "sinc", "lanczos", "spline"], help="Scaling algorithm")
 
 	parser.add_argument("--brightness", metavar="brightness", type=float, default=0.0, help="Brightness adjustment (default 0.0)")
@@ -245,58 +598,70 @@ def main():
 	parser.add_argument("-gt", "--gif-transparency", action="store_true", help="Enable GIF transparency")
 
 	parser.add_argument("-g", "--garbage", default=0, action="count", help="Garbage mode (lowers bitrate to shrink video files)")
-	parser.add_argument("--fixrgb", type=str, metavar="mode", default="0", choices=["0", "1", "2"], help="Convert TV RGB range to PC RGB range (hacky)")
+	parser.add_argument("--fixrgb", type=int, metavar="mode", default=0, choices=[0, 1, 2], help="Convert TV RGB range to PC RGB range (hacky)")
 	parser.add_argument("--debug", action="store_true", help="Debug mode (displays lots of additional information)")
 
 	extra_group = parser.add_mutually_exclusive_group()
-	extra_group.add_argument("-yt", "--youtube", action="store_true", help="YouTube mode (adds options to make YouTube happy)")
-	extra_group.add_argument("-nv", "--nvidia",  action="store_true", help="Enable hardware acceleration for Nvidia GPUs (experimental)")
+	extra_group.add_argument("-yt", "--youtube", dest="mode", action="store_const", const="youtube", help="YouTube mode (adds options to make YouTube happy)")
+	extra_group.add_argument("-nv", "--nvidia",  dest="mode", action="store_const", const="nvidia", help="Enable hardware acceleration for Nvidia GPUs (experimental)")
 
-	extra_group.add_argument("--x264", action="store_true", help="Use libx264")
-	extra_group.add_argument("--x265", action="store_true", help="Use libx265")
-	extra_group.add_argument("--gif",  action="store_true", help="Create an animated GIF")
-	extra_group.add_argument("--apng", action="store_true", help="Create an animated PNG")
-	extra_group.add_argument("--webp", action="store_true", help="Create an animated WebP image (untested)")
+	extra_group.add_argument("--x264", dest="mode", action="store_const", const="x264", help="Use libx264")
+	extra_group.add_argument("--x265", dest="mode", action="store_const", const="x265", help="Use libx265")
+	extra_group.add_argument("--gif",  dest="mode", action="store_const", const="gif", help="Create an animated GIF")
+	extra_group.add_argument("--apng", dest="mode", action="store_const", const="apng", help="Create an animated PNG")
+	extra_group.add_argument("--webp", dest="mode", action="store_const", const="webp", help="Create an animated WebP image (untested)")
+	extra_group.add_argument("--mode", type=str, choices=list(MODE_CODECS), help="Output mode, same as the options above")
+	parser.set_defaults(mode="x264")
 
 	parser.add_argument("out", type=str, help="out file")
 
-	args = parser.parse_args()
+	return parser
 
-	video_info = get_video_info(args.i, args.debug)
+_PARSER = _build_parser()
 
-	start_secs = parse_ffmpeg_timestamp(args.ss, args.debug)
-	if args.to:
-		duration_secs = parse_ffmpeg_timestamp(args.to, args.debug) - start_secs
-	elif args.t:
-		duration_secs = parse_ffmpeg_timestamp(args.t, args.debug)
-	else:
-		duration_secs = video_info["duration"] - start_secs
+def main():
+	FAST_SEEK = False
 
+	args = _PARSER.parse_args()
+	youtube = args.mode == "youtube"
+	nvidia = args.mode == "nvidia"
+	gif = args.mode == "gif"
+
+	probe_proc = None
+	video_info = None
+
+	def probe():
+		nonlocal video_info
+		if video_info is None:
+			video_info = get_video_info(args.i, args.debug, probe_proc)
+		return video_info
+
+	# ffprobe is only needed for the duration fallback, relative sizes, cropping in Nvidia mode, and YouTube mode,
+	# so only start it early in those cases and wait for it once its results are needed
+	relative_size = (args.width or args.height or "").endswith("x")
+	# only absolute crops can be done by the decoder, see below
+	nv_crop = nvidia and args.crop and all(p.isdigit() for p in args.crop.split(":"))
+	if youtube or relative_size or nv_crop or not (args.t or args.to):
+		video_info = load_video_info(args.i)
+		if video_info is None:
+			probe_proc = start_video_info(args.i)
+
+	crf_x264 = CRF_X264
+	crf_x265 = CRF_X265
 	if args.garbage:
 		print(f"Garbage Factor: {args.garbage}")
-		CRF_X264 = int(CRF_X264 + (args.garbage * 3))
-		CRF_X265 = int(CRF_X265 + (args.garbage * 3))
-
-	if args.youtube or args.x264:
-		args.codec = "libx264"
-		print(f"CRF: {CRF_X264}")
-	elif args.x265:
-		args.codec = "libx265"
-		print(f"CRF: {CRF_X265}")
-	elif args.nvidia:
-		args.codec = "h264_cuvid"
-		print(f"CRF: {CRF_X264}")
-	elif args.gif:
-		args.codec = "gif"
-	elif args.apng:
-		args.codec = "apng"
-	elif args.webp:
-		args.codec = "libwebp"
-	else:
-		args.codec = "libx264" # default codec
-		print(f"CRF: {CRF_X264}")
-
-	if args.gif or args.fast_seek:
+		crf_x264 = int(crf_x264 + (args.garbage * 3))
+		crf_x265 = int(crf_x265 + (args.garbage * 3))
+
+	args.codec = MODE_CODECS[args.mode]
+	if args.codec == "libx264":
+		print(f"CRF: {crf_x264}")
+	elif args.codec == "libx265":
+		print(f"CRF: {crf_x265}")
+	elif args.codec == "h264_nvenc":
+		print(f"QP: {QP_NVENC}")
+
+	if gif or args.fast_seek:
 		# for GIF creation, fast seek needs to be enabled
 		FAST_SEEK = True
 
@@ -304,12 +669,21 @@ def main():
 		args.fadein = args.fade
 		args.fadeout = args.fade
 
+	start_secs = parse_ffmpeg_timestamp(args.ss, args.debug)
+
+	if args.to:
+		duration_secs = parse_ffmpeg_timestamp(args.to, args.debug) - start_secs
+	elif args.t:
+		duration_secs = parse_ffmpeg_timestamp(args.t, args.debug)
+	else:
+		duration_secs = probe()["duration"] - start_secs
+
 	if FAST_SEEK:
 		fadein_start  = 0
-		fadeout_start = round(duration_secs - float(args.fadeout or 0), 4)
+		fadeout_start = round(duration_secs - (args.fadeout or 0), 4)
 	else:
 		fadein_start  = round(start_secs, 4)
-		fadeout_start = round(start_secs + duration_secs - float(args.fadeout or 0), 4)
+		fadeout_start = round(start_secs + duration_secs - (args.fadeout or 0), 4)
 
 	if args.crop:
 		crop_params = args.crop.split(":")
@@ -318,6 +692,16 @@ def main():
 		else:
 			raise RuntimeError("welp")
 
+	# in Nvidia mode, crop in the decoder so frames don't have to leave the GPU for it
+	opt_nv_decoder = []
+	if nv_crop:
+		decoder = CUVID_DECODERS.get(probe().get("codec_name"))
+		crop_w, crop_h, crop_x, crop_y = map(int, crop_params)
+		crop_bottom = probe()["height"] - crop_h - crop_y
+		crop_right = probe()["width"] - crop_w - crop_x
+		if decoder and crop_bottom >= 0 and crop_right >= 0:
+			opt_nv_decoder = ["-c:v", decoder, "-crop", f"{crop_y}x{crop_bottom}x{crop_x}x{crop_right}"]
+
 	loop_amount = 0
 	if args.loop:
 		loop_amount = abs(int(args.loop)) - 1
@@ -325,12 +709,12 @@ def main():
 	if args.width or args.height:
 		new_size = args.width or args.height
 
-		if args.width:
-			video_size = float(video_info["width"])
-		elif args.height:
-			video_size = float(video_info["height"])
+		if new_size.endswith("x"):
+			if args.width:
+				video_size = float(probe()["width"])
+			elif args.height:
+				video_size = float(probe()["height"])
 
-		if new_size.lower().endswith("x"):
 			new_size_parsed = int(video_size * float(new_size[:-1]))
 		else:
 			new_size_parsed = int(new_size)
@@ -338,100 +722,118 @@ def main():
 		new_size_parsed = ceil_even(new_size_parsed)
 
 		if args.width:
-			size_str = f"{new_size_parsed}:-2"
+			scale_w, scale_h = new_size_parsed, -2
 		elif args.height:
-			size_str = f"-2:{new_size_parsed}"
+			scale_w, scale_h = -2, new_size_parsed
 
-		if args.nvidia:
+		size_str = f"{scale_w}:{scale_h}"
+
+		if nvidia:
 			filter_scale = f"scale_cuda={size_str}"
+		elif args.scale_mode in ZSCALE_FILTERS and "zscale" in available_filters():
+			# zimg's resizer is faster than swscale at comparable or better quality
+			filter_scale = f"zscale=w={scale_w}:h={scale_h}:filter={ZSCALE_FILTERS[args.scale_mode]}"
 		else:
 			filter_scale = f"scale={size_str}:flags={args.scale_mode}+accurate_rnd+full_chroma_int+full_chroma_inp"
 	else:
 		filter_scale = None
 
 	# Just set all the important parameters and hope that's enough (if fixrgb > 0)
-	opt_fixrgb = ["-colorspace", "bt709", "-color_range", "jpeg", "-color_primaries", "bt709", "-color_trc", "bt709"] if (int(args.fixrgb) or 0) > 0 else []
+	opt_fixrgb = ["-colorspace", "bt709", "-color_range", "jpeg", "-color_primaries", "bt709", "-color_trc", "bt709"] if args.fixrgb > 0 else []
 
 	# Force the video output to full range RGB as well (if fixrgb == 2)
-	filter_fixrgb = "scale=in_range=tv:out_range=pc" if int(args.fixrgb) == 2 else None
-
-	filter_vfadein = f"fade=t=in:st={fadein_start}:d={args.fadein}" if args.fadein else None
-	filter_vfadeout = f"fade=t=out:st={fadeout_start}:d={args.fadeout}" if args.fadeout else None
+	filter_fixrgb = "scale=in_range=tv:out_range=pc" if args.fixrgb == 2 else None
 
 	transparency = "1" if args.gif_transparency else "0"
-	filter_palettegen = f"palettegen=stats_mode={args.gif_stats}:reserve_transparent={transparency}:max_colors={args.gif_colors}" if args.gif else None
+	filter_palettegen = f"palettegen=stats_mode={args.gif_stats}:reserve_transparent={transparency}:max_colors={args.gif_colors}" if gif else None
 	filter_paletteuse = f"paletteuse=diff_mode=rectangle:bayer_scale=1:dither={args.gif_dither}"
 
-	if args.nvidia:
-		if args.fadein and args.fadeout:
-			# override if both fades are set to avoid multiple hwupload/hwdownloads
-			filter_vfadein = f"hwdownload,format=nv12,{filter_vfadein}"
-			filter_vfadeout = f"{filter_vfadeout},hwupload"
-		else:
-			filter_vfadein = f"hwdownload,format=nv12,{filter_vfadein},hwupload" if args.fadein else None
-			filter_vfadeout = f"hwdownload,format=nv12,{filter_vfadeout},hwupload" if args.fadeout else None
-
-	filter_avolume = f"volume={args.volume}" if args.volume else None
-	filter_normalize = "dynaudnorm=correctdc=1:altboundary=1" if args.normalize else None
-	filter_afadein = f"afade=t=in:st={fadein_start}:d={args.fadein}:curve=losi" if args.fadein else None
-	filter_afadeout = f"afade=t=out:st={fadeout_start}:d={args.fadeout}:curve=losi" if args.fadeout else None
-
 	filter_fps = f"fps=fps={args.framerate}" if args.framerate else None
 
-	filter_crop = f"crop={crop_width}:{crop_height}:{crop_x}:{crop_y}" if args.crop else None
+	filter_crop = f"crop={crop_width}:{crop_height}:{crop_x}:{crop_y}" if args.crop and not opt_nv_decoder else None
 
-	filter_loop = f"loop=loop={loop_amount}:size=32767:start=0"
+	filter_loop = f"loop=loop={loop_amount}:size=32767:start=0" if loop_amount else None
 
-	filter_eq = f"eq=brightness={args.brightness}:saturation={args.saturation}:contrast={args.contrast}"
+	# skipped at the defaults, where it wouldn't change anything
+	eq_changed = (args.brightness, args.saturation, args.contrast) != (0.0, 1.0, 1.0)
+	filter_eq = f"eq=brightness={args.brightness}:saturation={args.saturation}:contrast={args.contrast}" if eq_changed else None
 
 	filter_sharpen = "unsharp" if args.sharpen else None
 
-	filter_vfade = ",".join(filter(None, [filter_vfadein, filter_vfadeout]))
-	filter_audio = ",".join(filter(None, [filter_avolume, filter_normalize, filter_afadein, filter_afadeout]))
+	vfade_parts = []
+	afilter_parts = []
+	if args.volume:
+		afilter_parts.append(f"volume={args.volume}")
+	if args.normalize:
+		afilter_parts.append("dynaudnorm=correctdc=1:altboundary=1")
+	if args.fadein:
+		vfade_parts.append(f"fade=t=in:st={fadein_start}:d={args.fadein}")
+		afilter_parts.append(f"afade=t=in:st={fadein_start}:d={args.fadein}:curve=losi")
+	if args.fadeout:
+		vfade_parts.append(f"fade=t=out:st={fadeout_start}:d={args.fadeout}")
+		afilter_parts.append(f"afade=t=out:st={fadeout_start}:d={args.fadeout}:curve=losi")
+
+	filter_vfade = ",".join(vfade_parts)
+	filter_audio = ",".join(afilter_parts)
+
+	opt_passthrough = shlex.split(args.ffmpeg) if args.ffmpeg else []
 
-	opt_passthrough = args.ffmpeg.split(" ") if args.ffmpeg else []
+	opt_metadata = ["-metadata", f"title={args.title}"] if args.title else []
 
-	opt_metadata = ["-metadata", f"title=\"{args.title}\""] if args.title else []
+	opt_global = list(OPT_GLOBAL)
 
-	opt_global = "-loglevel warning -hide_banner".split(" ")
+	# make ffmpeg use all cores for decoding and filtering, the Nvidia mode does that on the GPU
+	filter_threads = str(os.cpu_count() or 4)
+	opt_threads = ["-filter_threads", filter_threads, "-filter_complex_threads", filter_threads]
+	if not nvidia:
+		opt_threads = ["-threads", "0"] + opt_threads
 
 	convert_audio = args.audio_force or (filter_audio != None)
 
 	opt_acodec_bitrate = "128k" if args.garbage else "256k"
 	opt_acodec = ["-c:a", "aac", "-b:a", opt_acodec_bitrate] if convert_audio else ["-c:a", "copy"]
-	opt_audio = ["-an"] if args.mute or args.gif else opt_acodec
+	opt_audio = ["-an"] if args.mute or gif else opt_acodec
 	opt_afilter = ["-af", filter_audio] if filter_audio and not args.mute else []
 
 	opt_duration = ["-t", f"{duration_secs:.4f}"] if args.t or args.to else []
 
-	opt_vfilter_joined = ",".join(filter(None, [filter_fps, filter_fixrgb, filter_crop, filter_scale, filter_eq, filter_sharpen, filter_loop, filter_vfade, filter_palettegen]))
+	video_filters = {
+		"fps": filter_fps,
+		"fixrgb": filter_fixrgb,
+		"crop": filter_crop,
+		"scale": filter_scale,
+		"eq": filter_eq,
+		"sharpen": filter_sharpen,
+		"loop": filter_loop,
+		"vfade": filter_vfade,
+	}
+
+	if nvidia:
+		# decoded frames stay on the GPU, so only the CPU-only filters need to be downloaded
+		opt_vfilter_joined = _hw_chain([(video_filters[name], on_gpu) for name, on_gpu in VIDEO_FILTERS])
+	else:
+		opt_vfilter_joined = _join(",", *(video_filters[name] for name, _ in VIDEO_FILTERS))
 	opt_vfilter = ["-vf", opt_vfilter_joined] if opt_vfilter_joined else []
 
-	if args.youtube:
-		yt_index1 = closest(video_info["r_frame_rate"], YT_BITRATES.keys())
-		yt_index2 = closest(video_info["height"], YT_BITRATES[yt_index1].keys())
-		yt_bitrate = YT_BITRATES[yt_index1][yt_index2]
+	if youtube:
+		if "r_frame_rate" not in probe():
+			raise RuntimeError("Couldn't determine the input's frame rate, which YouTube mode needs.")
+
+		yt_index1 = closest(probe()["r_frame_rate"], _YT_FPS_KEYS)
+		yt_index2 = closest(probe()["height"], _YT_HEIGHT_KEYS)
+		yt_maxrate, yt_bufsize = YT_BITRATES[yt_index1][yt_index2]
 		opt_youtube = ["-movflags", "+faststart",
-					   "-maxrate", yt_bitrate,
-					   "-bufsize", f"{round(int(yt_bitrate[:-1])*1.5)}M",
-					   "-g", f"{video_info['r_frame_rate'] / 2}",
+					   "-maxrate", yt_maxrate,
+					   "-bufsize", yt_bufsize,
+					   "-g", str(max(1, round(probe()["r_frame_rate"] / 2))),
 					   "-bf", "2",
 					   "-pix_fmt", "yuv420p"] \
-					   if args.youtube else []
+					   if youtube else []
 	else:
 		opt_youtube = []
 
-	opt_nv_hwaccel = "-hwaccel cuvid".split(" ") if args.nvidia else []
-	opt_hardware = opt_nv_hwaccel
-
-	CODEC_OPTIONS = {
-		"libx264": f"-crf {CRF_X264} -preset {PRESET} -pix_fmt yuv420p -tune film -profile:v high -level 5.2".split(" ") + opt_fixrgb + opt_youtube,
-		"libx265": f"-crf {CRF_X265} -preset {PRESET}".split(" "),
-		"h264_cuvid": f"-preset {PRESET} -profile:v high -level 5.2 -rc constqp -qp {QP_NVENC} -strict_gop true -rc-lookahead 48 -spatial-aq true -temporal-aq true -aq-strength 8".split(" "),
-		"gif": f"-f gif -loop 0".split(" "),
-		"apng": f"-f apng -plays 0".split(" "),
-		"libwebp": f"-f webp -loop 0".split(" ")
-	}
+	opt_nv_hwaccel = list(NV_HWACCEL) if nvidia else []
+	opt_hardware = opt_nv_hwaccel + opt_nv_decoder
 
 	opts_seek  = ["-ss", str(round(start_secs, 4))] if args.ss != "0" else []
 	opts_input = ["-i", args.i]
@@ -441,18 +843,53 @@ def main():
 		opt_input = opts_input + opts_seek
 
 	opt_input += opt_duration
-	opt_codec = CODEC_OPTIONS[args.codec]
+	if args.codec == "libx264":
+		opt_codec = ["-crf", str(crf_x264)] + list(CODEC_OPTIONS[args.codec]) + opt_fixrgb + opt_youtube
+	elif args.codec == "libx265":
+		opt_codec = ["-crf", str(crf_x265)] + list(CODEC_OPTIONS[args.codec])
+	else:
+		opt_codec = list(CODEC_OPTIONS[args.codec])
+
+	palette_tmp = None
+	if gif:
+		# exporting a GIF, the palette is generated and applied in a single pass
+		filter_gif = _join(",", *(video_filters[name] for name, _ in VIDEO_FILTERS if name != "loop"))
+		palette_file = palette_cache_path(args.i, opts_seek, opt_duration, filter_gif, filter_palettegen)
+
+		# limit the input itself, palettegen only emits its palette once its input ends
+		opt_input = opts_seek + opt_duration + opts_input
+		opt_palette = []
+		if palette_file and os.path.exists(palette_file):
+			# the palette for this exact input and filter chain was already generated by an earlier run
+			opt_input += ["-i", palette_file]
+			gif_input = f"[0:v]{filter_gif}[v];[v]" if filter_gif else "[0:v]"
+			filter_graph = f"{gif_input}[1:v]{filter_paletteuse}[out]"
+			print("Using cached GIF palette…")
+		else:
+			if palette_file:
+				try:
+					os.makedirs(CACHE_DIR, exist_ok=True)
+					palette_tmp = f"{os.path.splitext(palette_file)[0]}.{os.getpid()}.png"
+				except OSError:
+					pass
+
+			if palette_tmp:
+				# also write the generated palette for future runs, it's only moved into the cache once ffmpeg succeeds.
+				# stdin is disabled because quitting with q would exit cleanly with a palette of only part of the clip
+				filter_graph = f"[0:v]{_join(',', filter_gif, 'split')}[a][b];[a]{filter_palettegen},split[p][pc];[b][p]{filter_paletteuse}[out]"
+				opt_palette = ["-map", "[pc]", "-frames:v", "1", palette_tmp]
+				opt_global += ["-nostdin"]
+			else:
+				filter_graph = f"[0:v]{_join(',', filter_gif, 'split')}[a][b];[a]{filter_palettegen}[p];[b][p]{filter_paletteuse}[out]"
 
-	if args.gif:
-		# exporting a GIF
-		_, palette_file = mkstemp(prefix="palette_", suffix=".gif")
-		ffmpeg_args = ["ffmpeg"] + opt_global + \
+		ffmpeg_args = ["ffmpeg"] + opt_threads + opt_global + \
 						opt_input + \
+						["-filter_complex", filter_graph, "-map", "[out]"] + \
 						["-c:v", args.codec] + opt_codec + \
 						opt_audio + opt_afilter + \
-						opt_vfilter + opt_metadata + opt_passthrough + \
-						["-y", palette_file]
-		print("Creating GIF palette…")
+						opt_metadata + opt_passthrough + \
+						["-y", args.out] + opt_palette
+		print("Creating GIF…")
 	else:
 		# exporting a video, an APNG, or an animated WebP image
 
@@ -461,7 +898,7 @@ def main():
 			seek_str = format_seconds_as_timestamp(start_secs)
 			comment += f", starting at {seek_str}"
 
-		ffmpeg_args = ["ffmpeg"] + opt_global + \
+		ffmpeg_args = ["ffmpeg"] + opt_threads + opt_global + \
 						opt_hardware + opt_input + \
 						["-c:v", args.codec] + opt_codec + \
 						opt_audio + opt_afilter + \
@@ -470,40 +907,22 @@ def main():
 						["-y", args.out]
 		print("Encoding output file…")
 
-	# first pass
-	success, returncode = start_ffmpeg(ffmpeg_args, args.debug)
-	if not success:
-		print(f"ffmpeg exited with code {returncode}.")
-		sys.exit(returncode)
-
-	# do second GIF creation pass
-	if args.gif:
-		print("Creating GIF…")
-
-		if FAST_SEEK:
-			opt_input = opts_seek + ["-i", args.i, "-i", palette_file] + opt_duration
-		else:
-			opt_input = ["-i", args.i, "-i", palette_file] + opts_seek + opt_duration
-
-		# opt_input = ["-i", args.i, "-i", palette_file]
-
-		opt_vfilter_joined = ",".join(filter(None, [filter_fps, filter_fixrgb, filter_crop, filter_scale, filter_eq, filter_sharpen, filter_vfade, filter_paletteuse]))
-		opt_vfilter = ["-lavfi", opt_vfilter_joined] if opt_vfilter_joined else []
-
-		ffmpeg_args = ["ffmpeg"] + opt_global + \
-						opt_input + \
-						["-c:v", args.codec] + opt_codec + \
-						opt_audio + opt_afilter + \
-						opt_vfilter + opt_metadata + opt_passthrough + \
-						["-y", args.out]
+	# the palette has to be moved into the cache after ffmpeg exits, so don't exec in that case
+	if not (args.debug or args.follow or palette_tmp) and sys.stdout.isatty():
+		# nothing left to do after encoding, so let ffmpeg replace this process and write to the terminal directly
+		sys.stdout.flush()
+		os.execvp(ffmpeg_args[0], ffmpeg_args)
 
+	success = False
+	try:
 		success, returncode = start_ffmpeg(ffmpeg_args, args.debug)
-		if not success:
-			print(f"ffmpeg exited with code {returncode}.")
-			sys.exit(returncode)
+	finally:
+		if palette_tmp:
+			finish_palette(palette_tmp, palette_file, success)
 
-		# clean up
-		os.remove(palette_file)
+	if not success:
+		print(f"ffmpeg exited with code {returncode}.")
+		sys.exit(returncode)
 
 	try:
 		out_size = getsize(args.out)